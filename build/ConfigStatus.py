@@ -65,25 +65,53 @@ class FileAvoidWrite(StringIO):
     def close(self):
         buf = self.getvalue()
         StringIO.close(self)
+
+        # Reading the old file back is only worthwhile if it could compare
+        # equal. Universal newline translation can only shrink what we read,
+        # so an existing file smaller than the buffer can't match and we
+        # skip straight to writing. If stat fails, let the open below sort
+        # out whether the file exists.
         try:
-            file = open(self.filename, 'rU')
-        except IOError:
-            pass
-        else:
+            comparable = os.path.getsize(self.filename) >= len(buf)
+        except OSError:
+            comparable = True
+
+        if comparable:
             try:
-                 if file.read() == buf:
-                     log("%s is unchanged" % relpath(self.filename, os.curdir))
-                     return
+                file = open(self.filename, 'rU')
             except IOError:
                 pass
-            finally:
-                file.close()
+            else:
+                try:
+                     if self._compare_chunked(file, buf):
+                         log("%s is unchanged" % relpath(self.filename, os.curdir))
+                         return
+                except IOError:
+                    pass
+                finally:
+                    file.close()
 
         log("creating %s" % relpath(self.filename, os.curdir))
         ensureParentDir(self.filename)
         with open(self.filename, 'w') as file:
             file.write(buf)
 
+    @staticmethod
+    def _compare_chunked(file, buf):
+        '''Compare an open file against a buffer in fixed-size chunks,
+        stopping at the first difference, so a changed large file is never
+        read or held in memory in its entirety.
+        '''
+        offset = 0
+        while True:
+            data = file.read(32768)
+            if not data:
+                return offset == len(buf)
+            end = offset + len(data)
+            if buf[offset:end] != data:
+                return False
+            offset = end
+
     def __enter__(self):
         return self
     def __exit__(self, type, value, traceback):
@@ -11,27 +11,61 @@ import re
 from mozbuild.util import hash_file
 
 
-# Regular expression to strip ANSI color sequences from a string. This is
-# needed to properly analyze Clang compiler output, which may be colorized.
-# It assumes ANSI escape sequences.
-RE_STRIP_COLORS = re.compile(r'\x1b\[[\d;]+m')
+def strip_ansi_colors(line):
+    """Strip ANSI color sequences from a line.
 
-# This captures Clang diagnostics with the standard formatting.
+    This is needed to properly analyze Clang compiler output, which may be
+    colorized. Scanning for the escape introducer directly beats a regular
+    expression substitution for the typical case of a few short sequences
+    in an otherwise plain line.
+    """
+    parts = []
+    start = 0
+    length = len(line)
+
+    while True:
+        idx = line.find('\x1b[', start)
+        if idx == -1:
+            parts.append(line[start:])
+            break
+
+        # Skip over the color parameters, which are digits separated by
+        # semicolons and terminated by 'm'.
+        end = idx + 2
+        while end < length and (line[end].isdigit() or line[end] == ';'):
+            end += 1
+
+        if end > idx + 2 and end < length and line[end] == 'm':
+            parts.append(line[start:idx])
+            start = end + 1
+        else:
+            # Not a color sequence. Leave it alone.
+            parts.append(line[start:end])
+            start = end
+
+    return ''.join(parts)
+
+# This captures Clang diagnostics with the standard formatting. The
+# character classes are bounded so matching fails quickly on long lines
+# that merely resemble a warning, instead of backtracking through them.
 RE_CLANG_WARNING = re.compile(r"""
-    (?P<file>[^:]+)
+    (?P<file>[^:\n]{1,4096})
     :
     (?P<line>\d+)
     :
     (?P<column>\d+)
     :
     \swarning:\s
-    (?P<message>[^\[]+)
-    \[(?P<flag>[^\]]+)
+    (?P<message>[^\[\n]+)
+    \[(?P<flag>[^\]\n]+)
     """, re.X)
 
-# This captures Visual Studio's warning format.
+# This captures Visual Studio's warning format. The file component must
+# allow parentheses because MSVC system headers live under paths like
+# 'Program Files (x86)'; only the length is bounded. Lines only reach
+# this pattern after the ': warning' prefilter in process_line.
 RE_MSVC_WARNING = re.compile(r"""
-    (?P<file>.*)
+    (?P<file>.{1,4096})
     \((?P<line>\d+)\)
     \s:\swarning\s
     (?P<flag>[^:]+)
@@ -66,8 +100,13 @@ class CompilerWarning(dict):
         return not self.__eq__(other)
 
     def __hash__(self):
-        """Define so this can exist inside a set, etc."""
-        return hash(tuple(sorted(self.items())))
+        """Define so this can exist inside a set, etc.
+
+        Only the fields considered by __eq__ participate, so two equal
+        warnings always hash identically, and we avoid sorting the items
+        on every hash lookup.
+        """
+        return hash((self['filename'], self['line'], self['column']))
 
 
 class WarningsDatabase(object):
@@ -96,13 +135,13 @@ class WarningsDatabase(object):
     def __init__(self):
         """Create an empty database."""
         self._files = {}
+        self._hash_cache = {}
+        self._dirty = False
+        self._total = 0
+        self._flag_counts = {}
 
     def __len__(self):
-        i = 0
-        for value in self._files.values():
-            i += len(value['warnings'])
-
-        return i
+        return self._total
 
     def __iter__(self):
         for value in self._files.values():
@@ -127,16 +166,7 @@ class WarningsDatabase(object):
     @property
     def type_counts(self):
         """Returns a mapping of warning types to their counts."""
-
-        types = {}
-        for value in self._files.values():
-            for warning in value['warnings']:
-                count = types.get(warning['flag'], 0)
-                count += 1
-
-                types[warning['flag']] = count
-
-        return types
+        return dict(self._flag_counts)
 
     def has_file(self, filename):
         """Whether we have any warnings for the specified file."""
@@ -157,20 +187,59 @@ class WarningsDatabase(object):
         new_hash = None
 
         if compute_hash:
-            new_hash = hash_file(filename)
+            new_hash = self._hash_file(filename)
 
         if filename in self._files:
             if new_hash != self._files[filename]['hash']:
-                del self._files[filename]
+                self._remove_file(filename)
 
         value = self._files.get(filename, {
             'hash': new_hash,
             'warnings': set(),
         })
 
-        value['warnings'].add(warning)
+        if warning not in value['warnings']:
+            value['warnings'].add(warning)
+            self._count_warning(warning, 1)
 
         self._files[filename] = value
+        self._dirty = True
+
+    def _hash_file(self, filename):
+        """Hash a file, caching the result until the file changes.
+
+        The same file commonly produces many warnings during a build (e.g.
+        a header included from many translation units). Keying the cache
+        off the stat data means each unique version of a file is only
+        hashed once.
+        """
+        st = os.stat(filename)
+        key = (filename, st.st_mtime, st.st_size)
+
+        existing = self._hash_cache.get(key)
+        if existing is None:
+            existing = hash_file(filename)
+            self._hash_cache[key] = existing
+
+        return existing
+
+    def _remove_file(self, filename):
+        """Remove a file and its warnings, keeping the counters current."""
+        value = self._files.pop(filename)
+
+        for warning in value['warnings']:
+            self._count_warning(warning, -1)
+
+    def _count_warning(self, warning, delta):
+        self._total += delta
+
+        flag = warning['flag']
+        count = self._flag_counts.get(flag, 0) + delta
+
+        if count:
+            self._flag_counts[flag] = count
+        else:
+            self._flag_counts.pop(flag, None)
 
     def prune(self):
         """Prune the contents of the database.
@@ -187,7 +256,8 @@ class WarningsDatabase(object):
         filenames = self._files.keys()
         for filename in filenames:
             if not os.path.exists(filename):
-                del self._files[filename]
+                self._remove_file(filename)
+                self._dirty = True
                 continue
 
             if self._files[filename]['hash'] is None:
@@ -195,46 +265,54 @@ class WarningsDatabase(object):
 
             current_hash = hash_file(filename)
             if current_hash != self._files[filename]['hash']:
-                del self._files[filename]
+                self._remove_file(filename)
+                self._dirty = True
                 continue
 
     def serialize(self, fh):
         """Serialize the database to an open file handle."""
-        obj = {'files': {}}
-
-        # All this hackery because JSON can't handle sets.
-        for k, v in self._files.iteritems():
-            obj['files'][k] = {}
 
-            for k2, v2 in v.iteritems():
-                normalized = v2
+        # JSON can't handle sets, so convert them through the default hook
+        # instead of copying the whole structure up front. CompilerWarning
+        # is a dict, so it serializes natively.
+        def default(obj):
+            if isinstance(obj, set):
+                return list(obj)
 
-                if k2 == 'warnings':
-                    normalized = [w for w in v2]
+            raise TypeError('%r is not JSON serializable' % obj)
 
-                obj['files'][k][k2] = normalized
-
-        json.dump(obj, fh, indent=2)
+        # Compact separators roughly halve the bytes written compared to
+        # indented output. Nobody reads this file by hand.
+        json.dump({'files': self._files}, fh, separators=(',', ':'),
+            default=default)
 
     def deserialize(self, fh):
         """Load serialized content from a handle into the current instance."""
-        obj = json.load(fh)
+
+        # Reading the whole file up front and parsing the resulting string
+        # is faster than letting the parser read incrementally through the
+        # handle.
+        obj = json.loads(fh.read())
 
         self._files = obj['files']
+        self._total = 0
+        self._flag_counts = {}
 
-        # Normalize data types.
-        for filename, value in self._files.iteritems():
-            for k, v in value.iteritems():
-                if k != 'warnings':
-                    continue
+        # Normalize the warnings into sets of CompilerWarning instances.
+        for value in self._files.itervalues():
+            normalized = set()
 
-                normalized = set()
-                for d in v:
-                    w = CompilerWarning()
-                    w.update(d)
+            for d in value['warnings']:
+                w = CompilerWarning()
+                w.update(d)
+
+                if w not in normalized:
                     normalized.add(w)
+                    self._count_warning(w, 1)
+
+            value['warnings'] = normalized
 
-                self._files[filename]['warnings'] = normalized
+        self._dirty = False
 
     def load_from_file(self, filename):
         """Load the database from a file."""
@@ -242,10 +320,30 @@ class WarningsDatabase(object):
             self.deserialize(fh)
 
     def save_to_file(self, filename):
-        """Save the database to a file."""
-        with open(filename, 'wb') as fh:
+        """Save the database to a file.
+
+        Writes are skipped if the database has not changed since it was
+        loaded or last saved, so callers can save liberally (e.g. on an
+        interval during a build) without rewriting identical content.
+        """
+        if not self._dirty:
+            return
+
+        # Serialize to a temporary file and rename into place so an
+        # interrupted write can't leave a truncated database behind.
+        tmp = filename + '.tmp'
+
+        with open(tmp, 'wb') as fh:
             self.serialize(fh)
 
+        # os.rename() can't replace an existing file on Windows.
+        if os.name == 'nt' and os.path.exists(filename):
+            os.remove(filename)
+
+        os.rename(tmp, filename)
+
+        self._dirty = False
+
 
 class WarningsCollector(object):
     """Collects warnings from text data.
@@ -263,6 +361,8 @@ class WarningsCollector(object):
         self.objdir = objdir
         self.resolve_files = resolve_files
         self.included_from = []
+        self._resolve_cache = {}
+        self._normpath_cache = {}
 
         if database is None:
             self.database = WarningsDatabase()
@@ -270,7 +370,12 @@ class WarningsCollector(object):
     def process_line(self, line):
         """Take a line of text and process it for a warning."""
 
-        filtered = RE_STRIP_COLORS.sub('', line)
+        # Stripping colors is much more expensive than scanning for the
+        # escape character, which almost no lines contain.
+        if '\x1b' in line:
+            filtered = strip_ansi_colors(line)
+        else:
+            filtered = line
 
         # Clang warnings in files included from the one(s) being compiled will
         # start with "In file included from /path/to/file:line:". Here, we
@@ -284,12 +389,28 @@ class WarningsCollector(object):
 
             return
 
+        # The overwhelming majority of lines are not warnings. A simple
+        # substring scan is much cheaper than the regular expressions, so
+        # we use it to filter out the uninteresting lines before matching.
+        head, sep, _ = filtered.partition(': warning')
+        if not sep:
+            self.included_from = []
+            return None
+
         warning = CompilerWarning()
         filename = None
 
-        # TODO make more efficient so we run minimal regexp matches.
-        match_clang = RE_CLANG_WARNING.match(filtered)
-        match_msvc = RE_MSVC_WARNING.match(filtered)
+        # What precedes ': warning' identifies the compiler: MSVC puts the
+        # line number in parentheses there, Clang uses bare colon-separated
+        # fields. Only attempt the regular expression that can match.
+        match_clang = None
+        match_msvc = None
+
+        if head.rstrip().endswith(')'):
+            match_msvc = RE_MSVC_WARNING.match(filtered)
+        else:
+            match_clang = RE_CLANG_WARNING.match(filtered)
+
         if match_clang:
             d = match_clang.groupdict()
 
@@ -310,7 +431,16 @@ class WarningsCollector(object):
             self.included_from = []
             return None
 
-        filename = os.path.normpath(filename)
+        # normpath is a pure string operation, but hot headers repeat the
+        # same filename across many warnings, so memoize it.
+        normalized = self._normpath_cache.get(filename)
+        if normalized is None:
+            normalized = os.path.normpath(filename)
+
+            if len(self._normpath_cache) < 8192:
+                self._normpath_cache[filename] = normalized
+
+        filename = normalized
 
         # Sometimes we get relative includes. These typically point to files in
         # the object directory. We try to resolve the relative path.
@@ -328,6 +458,22 @@ class WarningsCollector(object):
         return warning
 
     def _normalize_relative_path(self, filename):
+        # The same relative filename tends to recur with the same include
+        # chain (one warning per translation unit including it), so cache
+        # resolutions to avoid redoing the stat calls below.
+        key = (filename, tuple(self.included_from))
+
+        resolved = self._resolve_cache.get(key)
+        if resolved is None:
+            resolved = self._resolve_relative_path(filename)
+
+            # Guard against unbounded growth on pathological output.
+            if len(self._resolve_cache) < 4096:
+                self._resolve_cache[key] = resolved
+
+        return resolved
+
+    def _resolve_relative_path(self, filename):
         # Special case files in dist/include.
         idx = filename.find('/dist/include')
         if idx != -1:
@@ -14,6 +14,9 @@ from mozbuild.compilation.warnings import WarningsDatabase
 
 CLANG_TESTS = [
     ('foobar.cpp:123:10: warning: you messed up [-Wfoo]',
+     'foobar.cpp', 123, 10, 'you messed up', '-Wfoo'),
+    ('\x1b[1mfoobar.cpp:123:10: \x1b[0;1;35mwarning: \x1b[0m\x1b[1myou '
+         'messed up [-Wfoo]\x1b[0m',
      'foobar.cpp', 123, 10, 'you messed up', '-Wfoo')
 ]
 
@@ -21,6 +24,12 @@ MSVC_TESTS = [
     ("C:/mozilla-central/test/foo.cpp(793) : warning C4244: 'return' : "
      "conversion from 'double' to 'uint32_t', possible loss of data",
      'C:/mozilla-central/test/foo.cpp', 793, 'C4244',
+     "'return' : conversion from 'double' to 'uint32_t', possible loss of "
+         'data'),
+    ("C:/Program Files (x86)/MSVC/include/xstring(793) : warning C4244: "
+     "'return' : conversion from 'double' to 'uint32_t', possible loss of "
+     'data',
+     'C:/Program Files (x86)/MSVC/include/xstring', 793, 'C4244',
      "'return' : conversion from 'double' to 'uint32_t', possible loss of "
          'data')
 ]
@@ -138,6 +147,24 @@ class TestWarningsDatabase(unittest.TestCase):
         with self.assertRaises(Exception):
             db.insert(w)
 
+    def test_serialize(self):
+        """Ensure serialization and deserialization round trip."""
+        db = WarningsDatabase()
+
+        for i in xrange(10):
+            db.insert(get_warning(), compute_hash=False)
+
+        temp = NamedTemporaryFile()
+        db.save_to_file(temp.name)
+
+        db2 = WarningsDatabase()
+        db2.load_from_file(temp.name)
+
+        self.assertEqual(len(db2), 10)
+
+        for warning in db:
+            self.assertIn(warning, db2)
+
     def test_pruning(self):
         """Ensure old warnings are removed from database appropriately."""
         db = WarningsDatabase()
@@ -6,6 +6,8 @@
 # in particular.
 
 import hashlib
+import mmap
+import os
 
 
 def hash_file(path):
@@ -16,12 +18,17 @@ def hash_file(path):
     h = hashlib.sha1()
 
     with open(path, 'rb') as fh:
-        while True:
-            data = fh.read(8192)
-
-            if not len(data):
-                break
-
-            h.update(data)
+        size = os.fstat(fh.fileno()).st_size
+
+        # Mapping the file and hashing it in one update() call avoids a
+        # Python-level read loop and its per-chunk allocations. Empty files
+        # can't be mapped.
+        if size > 0:
+            mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+            try:
+                h.update(mm)
+            finally:
+                mm.close()
 
     return h.hexdigest()